@@ -0,0 +1,385 @@
+"""Keycloak authentication for the CareTwin API.
+
+Wraps the Keycloak OpenID Connect endpoints (token, userinfo, certs) and
+provides the FastAPI dependencies used to protect routes: bearer-token
+verification against the realm's JWKS and role-based access checks.
+"""
+
+import base64
+import functools
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import httpx
+import jwt
+import orjson
+from cachetools import TTLCache
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+security = HTTPBearer()
+
+# Parsed JWKS state is process-wide so every KeycloakAuth instance (and
+# every threadpool worker) shares one set of RSA key objects instead of
+# each instance fetching and parsing the realm JWKS on its own.
+_PUBLIC_KEYS: dict = {}
+_KEYS_LOCK = threading.Lock()
+_JWKS_ETAG = None
+_JWKS_LAST_REFRESH = 0.0
+_REFRESH_FUTURE: Future = None
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+class KeycloakAuth:
+    """Client for a single Keycloak realm.
+
+    Verified-token payloads are kept in a small LRU+TTL cache so that a
+    client reusing the same bearer token across requests only pays for the
+    RS256 signature check once per cache window instead of on every call.
+    """
+
+    def __init__(
+        self,
+        server_url: str = None,
+        realm: str = None,
+        client_id: str = None,
+        client_secret: str = None,
+        token_cache_maxsize: int = 10000,
+        token_cache_ttl: float = 5.0,
+    ):
+        self.server_url = server_url or os.getenv("KEYCLOAK_SERVER_URL", "http://localhost:8080")
+        self.realm = realm or os.getenv("KEYCLOAK_REALM", "caretwin")
+        self.client_id = client_id or os.getenv("KEYCLOAK_CLIENT_ID", "caretwin-api")
+        self.client_secret = client_secret or os.getenv("KEYCLOAK_CLIENT_SECRET", "")
+
+        self.base_url = f"{self.server_url.rstrip('/')}/realms/{self.realm}"
+        self.token_url = f"{self.base_url}/protocol/openid-connect/token"
+        self.userinfo_url = f"{self.base_url}/protocol/openid-connect/userinfo"
+        self.certs_url = f"{self.base_url}/protocol/openid-connect/certs"
+        self.logout_url = f"{self.base_url}/protocol/openid-connect/logout"
+
+        # One pooled HTTP/2-capable client for all Keycloak calls: token
+        # exchange, userinfo and JWKS refresh multiplex over a single
+        # kept-alive TLS connection instead of paying a handshake each.
+        self._session = httpx.Client(
+            timeout=10,
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+            ),
+        )
+
+        # Reusable verifier state: the padding and digest objects handed
+        # to cryptography's RSA verify are stateless, so build them once
+        # instead of letting a JWT library reconstruct them per call.
+        self._pad = padding.PKCS1v15()
+        self._hash = hashes.SHA256()
+
+        self._jwks_min_refresh_interval = 30.0
+
+        # Cache of already-verified tokens.  Keyed by the token's
+        # signature segment, which is a cryptographic commitment to the
+        # header+payload, so hashing the whole token again buys nothing.
+        # Each entry is a compact (exp, roles, sub, email, name) tuple —
+        # just what the endpoints consume — rather than the full claims
+        # dict, keeping a full cache to a few hundred KB.  Entries live
+        # for at most token_cache_ttl seconds and are never trusted past
+        # the token's own exp claim.
+        self._token_cache = TTLCache(maxsize=token_cache_maxsize, ttl=token_cache_ttl)
+        self._token_cache_lock = threading.Lock()
+
+        # Short-lived negative cache of recently-rejected tokens so a
+        # replayed bad token short-circuits instead of burning CPU on
+        # parse + RSA verify every retry.  Kept separate from the
+        # positive cache so evictions don't interfere.  Unlike the
+        # positive cache this is keyed by a SHA-256 of the whole token:
+        # a rejected token's signature commits to nothing, so keying by
+        # signature would let a tampered token poison the entry for the
+        # valid token sharing that signature.
+        self._neg_cache = TTLCache(maxsize=2048, ttl=2.0)
+
+    def _load_public_keys(self):
+        """Fetch the realm JWKS and merge kid -> RSA public key objects.
+
+        Parsed key objects are kept across reloads: only kids not seen
+        before are run through the (expensive) JWK parse, and a 304 from
+        Keycloak via If-None-Match skips the JSON parse entirely.
+        Refreshes are rate-limited so a flood of unknown kids cannot turn
+        into a flood of JWKS fetches.
+
+        Refreshes are single-flight: on a kid-rotation event the first
+        caller through here does the HTTP fetch while concurrent callers
+        wait on a shared Future instead of each firing their own GET at
+        Keycloak. The rate-limit re-check under _KEYS_LOCK is the second
+        half of the double-checked pattern (callers probe _PUBLIC_KEYS
+        lock-free first).
+        """
+        global _REFRESH_FUTURE
+
+        with _KEYS_LOCK:
+            now = time.monotonic()
+            if _PUBLIC_KEYS and now - _JWKS_LAST_REFRESH < self._jwks_min_refresh_interval:
+                return
+            leader = _REFRESH_FUTURE is None
+            if leader:
+                _REFRESH_FUTURE = Future()
+            future = _REFRESH_FUTURE
+
+        if not leader:
+            future.result()
+            return
+
+        try:
+            self._refresh_public_keys()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            with _KEYS_LOCK:
+                _REFRESH_FUTURE = None
+
+    def _refresh_public_keys(self):
+        """Do the actual JWKS fetch and merge; callers hold the single-flight."""
+        global _JWKS_ETAG, _JWKS_LAST_REFRESH
+
+        _JWKS_LAST_REFRESH = time.monotonic()
+        headers = {}
+        if _JWKS_ETAG:
+            headers["If-None-Match"] = _JWKS_ETAG
+        response = self._session.get(self.certs_url, headers=headers)
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        _JWKS_ETAG = response.headers.get("ETag")
+        jwks = orjson.loads(response.content)
+
+        for key in jwks.get("keys", []):
+            kid = key.get("kid")
+            if kid in _PUBLIC_KEYS:
+                continue
+            if key.get("use") == "sig" and key.get("kty") == "RSA":
+                _PUBLIC_KEYS[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(key)
+
+    def _reject(self, neg_key):
+        with self._token_cache_lock:
+            self._neg_cache[neg_key] = None
+        return None
+
+    def _claims_valid(self, payload: dict) -> bool:
+        """Check exp/iat/aud/iss against the realm configuration."""
+        if "exp" not in payload or "iat" not in payload:
+            return False
+        aud = payload.get("aud")
+        if isinstance(aud, str):
+            if aud != self.client_id:
+                return False
+        elif not (isinstance(aud, list) and self.client_id in aud):
+            return False
+        return payload.get("iss") == self.base_url
+
+    @staticmethod
+    def _entry_to_user(entry):
+        """Expand a compact cache entry into the dict handed to dependencies."""
+        exp, roles, sub, email, name = entry
+        return {
+            "exp": exp,
+            "sub": sub,
+            "email": email,
+            "name": name,
+            "_roles": roles,
+            "_profile": (sub, email, name, roles),
+        }
+
+    def verify_token(self, token: str):
+        """Verify a bearer token and return its claims, or None if invalid.
+
+        The hot path verifies the RS256 signature directly against
+        cryptography's RSA primitives with the pre-built padding and
+        digest objects, then checks the claims by hand — skipping the
+        per-call verifier construction a JWT library would redo.
+
+        Returns a dict carrying the fields the endpoints consume (sub,
+        email, name, exp, plus the _roles frozenset and _profile tuple),
+        built from the compact cache entry.
+        """
+        cache_key = token.rsplit(".", 1)[-1]
+        neg_key = hashlib.sha256(token.encode()).digest()
+        with self._token_cache_lock:
+            if neg_key in self._neg_cache:
+                return None
+            entry = self._token_cache.get(cache_key)
+        if entry is not None and entry[0] > time.time():
+            return self._entry_to_user(entry)
+
+        try:
+            header_b64, payload_b64, signature_b64 = token.split(".")
+            payload = orjson.loads(_b64url_decode(payload_b64))
+        except (ValueError, orjson.JSONDecodeError):
+            return self._reject(neg_key)
+        if not isinstance(payload, dict):
+            return self._reject(neg_key)
+
+        # Reject already-expired tokens before paying for an RSA verify;
+        # replayed expired tokens are the common abuse case.
+        if payload.get("exp", 0) < time.time():
+            return None
+
+        # Only kid and alg are needed from the header, so one b64 decode
+        # plus an orjson parse beats a library-level validation walk.
+        try:
+            header = orjson.loads(_b64url_decode(header_b64))
+        except (ValueError, orjson.JSONDecodeError):
+            return self._reject(neg_key)
+        if not isinstance(header, dict) or header.get("alg") != "RS256":
+            return self._reject(neg_key)
+
+        kid = header.get("kid")
+        if kid not in _PUBLIC_KEYS:
+            self._load_public_keys()
+        public_key = _PUBLIC_KEYS.get(kid)
+        if public_key is None:
+            return None
+
+        try:
+            public_key.verify(
+                _b64url_decode(signature_b64),
+                f"{header_b64}.{payload_b64}".encode("ascii"),
+                self._pad,
+                self._hash,
+            )
+        except (InvalidSignature, ValueError):
+            return self._reject(neg_key)
+
+        if not self._claims_valid(payload):
+            return self._reject(neg_key)
+
+        # Distill the claims dict down to the fields the endpoints
+        # consume once, at verify time: roles become a frozenset so role
+        # checks are a single membership probe, and the whole entry is a
+        # small tuple so a full cache stays compact.
+        roles = frozenset(payload.get("realm_access", {}).get("roles", ()))
+        entry = (
+            payload["exp"],
+            roles,
+            payload.get("sub", ""),
+            payload.get("email", ""),
+            payload.get("name") or payload.get("preferred_username", ""),
+        )
+
+        with self._token_cache_lock:
+            self._token_cache[cache_key] = entry
+        return self._entry_to_user(entry)
+
+    def get_client_credentials_token(self):
+        """Obtain a service-account token via the client_credentials grant."""
+        response = self._session.post(
+            self.token_url,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def exchange_authorization_code(self, code: str, redirect_uri: str):
+        """Exchange an authorization code for tokens."""
+        response = self._session.post(
+            self.token_url,
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": redirect_uri,
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def refresh_token(self, refresh_token: str):
+        """Refresh an access token using a refresh token."""
+        response = self._session.post(
+            self.token_url,
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def get_user_info(self, access_token: str):
+        """Fetch the userinfo document for an access token."""
+        response = self._session.get(
+            self.userinfo_url,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def close(self):
+        """Release the pooled HTTP connections."""
+        self._session.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+keycloak_auth = KeycloakAuth()
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """FastAPI dependency: verify the bearer token and return its payload.
+
+    verify_token does blocking network I/O (JWKS refresh) and CPU-bound
+    RSA verification, so it runs in the threadpool to keep the event
+    loop free for other requests.
+    """
+    payload = await run_in_threadpool(keycloak_auth.verify_token, credentials.credentials)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+
+@functools.lru_cache(maxsize=32)
+def require_role(required_role: str):
+    """FastAPI dependency factory: require a realm role on the current user.
+
+    Memoized per role string so repeated Depends(require_role(...)) at
+    import time share one callable and FastAPI's per-request dependency
+    cache can deduplicate the underlying get_current_user call.
+    """
+
+    def check_role(current_user: dict = Depends(get_current_user)):
+        if required_role not in current_user["_roles"]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Role '{required_role}' required",
+            )
+        return current_user
+
+    return check_role
@@ -0,0 +1,168 @@
+"""CareTwin auth API.
+
+FastAPI application exposing the authentication endpoints (login, token
+refresh, logout) and a few protected resources used by the CareTwin
+frontend during development.
+"""
+
+import asyncio
+import contextlib
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+
+from keycloak_auth import get_current_user, keycloak_auth, require_role
+
+JWKS_REFRESH_INTERVAL = 300.0
+
+
+async def _jwks_refresh_loop():
+    while True:
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL)
+        try:
+            await run_in_threadpool(keycloak_auth._load_public_keys)
+        except Exception:
+            # Transient Keycloak outage; the next cycle (or an
+            # unknown-kid miss in the request path) retries.
+            pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the JWKS cache so the first authenticated request never eats
+    # a synchronous fetch + key parse, then keep it fresh off the
+    # request path.
+    try:
+        await run_in_threadpool(keycloak_auth._load_public_keys)
+    except Exception:
+        pass
+    refresh_task = asyncio.create_task(_jwks_refresh_loop())
+    yield
+    refresh_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await refresh_task
+
+
+app = FastAPI(
+    title="CareTwin Auth API",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "http://localhost:5173"],
+    allow_credentials=True,
+    # Enumerated explicitly so the middleware's hot path is a set lookup
+    # instead of wildcard matching; the API only serves GET and POST.
+    allow_methods=("GET", "POST"),
+    allow_headers=("authorization", "content-type"),
+)
+
+class UserProfile(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    sub: str
+    email: str = ""
+    name: str = ""
+    roles: list[str] = []
+
+
+class ModelData(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    id: str
+    name: str
+    description: str = ""
+
+
+class AuthCodeRequest(BaseModel):
+    code: str
+    redirect_uri: str
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+_models_adapter = TypeAdapter(list[ModelData])
+
+mock_models = [
+    {"id": "ct-heart-01", "name": "Cardiac twin", "description": "Patient cardiac digital twin"},
+    {"id": "ct-lung-01", "name": "Pulmonary twin", "description": "Patient pulmonary digital twin"},
+]
+
+# The catalog is static, so validate and dump it once at import; the
+# handler returns the precomputed plain-dict form.
+_mock_models_dump = _models_adapter.dump_python(_models_adapter.validate_python(mock_models))
+
+
+@app.get("/")
+def root():
+    return {"service": "caretwin-auth", "status": "running"}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.post("/auth/token")
+def exchange_code(request: AuthCodeRequest):
+    try:
+        return keycloak_auth.exchange_authorization_code(request.code, request.redirect_uri)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authorization code exchange failed",
+        )
+
+
+@app.post("/auth/refresh")
+def refresh(request: RefreshRequest):
+    try:
+        return keycloak_auth.refresh_token(request.refresh_token)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token refresh failed",
+        )
+
+
+@app.get("/protected")
+def protected(current_user: dict = Depends(get_current_user)):
+    return {
+        "message": "You are authenticated",
+        "sub": current_user.get("sub"),
+        "roles": sorted(current_user["_roles"]),
+    }
+
+
+@app.get("/profile", response_model=UserProfile)
+def profile(current_user: dict = Depends(get_current_user)):
+    sub, email, name, roles = current_user["_profile"]
+    return UserProfile(sub=sub, email=email, name=name, roles=sorted(roles))
+
+
+@app.get("/models")
+def list_models(current_user: dict = Depends(require_role("api_user"))):
+    return {"models": _mock_models_dump}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=os.cpu_count(),
+    )